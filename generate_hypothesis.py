@@ -12,12 +12,147 @@ Contributors:
 
 
 import json
+import random
 import fire
 import numpy as np
 
 import hypothesis_parser as parser
 
 
+# keys of each base action structure (see `generate_actions`), in text order
+ACTION_STRUCTURES = [
+    ('variable', 'qualifier', 'modifier'),
+    ('modifier', 'variable', 'qualifier'),
+    ('variable', 'qualifier', 'interactor', 'value'),
+    ('variable', 'qualifier', 'interactor', 'variable_', 'qualifier_'),
+    ('variable', 'qualifier', 'interactor', 'qualifier_'),
+]
+COMPOSED = len(ACTION_STRUCTURES)
+
+
+def _compact(ids: np.ndarray) -> np.ndarray:
+    """Moves the -1 paddings of each row to its end, keeping the order of the ids."""
+    return np.take_along_axis(ids, np.argsort(ids < 0, axis=1, kind='stable'), axis=1)
+
+
+class ActionTable:
+    """Actions generated from a domain (see `generate_actions`), stored column-wise.
+    Each token is an array of indices into its vocabulary (-1 where the action
+    lacks it), and composed actions point at the rows of their two halves in
+    `left` and `right`. Base actions come first, followed by the composed ones.
+    """
+
+    def __init__(self, variables: list, modifiers: list,
+                 interactors: list, qualifiers: list):
+        self.variables, self.modifiers = variables, modifiers
+        self.interactors, self.qualifiers = interactors, qualifiers
+        n_vq, n_q = len(variables) * len(qualifiers), len(qualifiers)
+        m, i = len(modifiers), len(interactors)
+        # per (variable, qualifier) block: structures 1 and 2 for each modifier,
+        # then structures 3, 4 and 4 for each interactor
+        block = np.concatenate([np.tile([0, 1], m), np.tile([2, 3, 4], i)])
+        structure = np.tile(block, n_vq)
+        variable = np.repeat(np.arange(len(variables)), n_q * len(block))
+        qualifier = np.tile(np.repeat(np.arange(n_q), len(block)), len(variables))
+        modifier = np.tile(np.concatenate([np.repeat(np.arange(m), 2), np.full(3 * i, -1)]), n_vq)
+        interactor = np.tile(np.concatenate([np.full(2 * m, -1), np.repeat(np.arange(i), 3)]), n_vq)
+        # one random value and second qualifier per (variable, qualifier, interactor)
+        value = np.full(len(structure), -1)
+        value[structure == 2] = np.random.randint(100, size=n_vq * i)
+        # index into the other qualifiers: drawing qi's own index maps to the last one
+        offsets = np.random.randint(n_q - 1, size=n_vq * i)
+        offsets[offsets == qualifier[structure == 2]] = n_q - 1
+        second_qualifier = np.full(len(structure), -1)
+        second_qualifier[(structure == 3) | (structure == 4)] = np.repeat(offsets, 2)
+        # sample pairs of actions of different variables, redrawing only the collisions
+        n = len(structure)
+        pairs = np.random.randint(n, size=(n, 2))
+        collisions = variable[pairs[:, 0]] == variable[pairs[:, 1]]
+        while collisions.any():
+            pairs[collisions] = np.random.randint(n, size=(collisions.sum(), 2))
+            collisions = variable[pairs[:, 0]] == variable[pairs[:, 1]]
+
+        def with_composed(column, composed_column=-1, dtype=np.int16):
+            return np.concatenate([column, np.broadcast_to(composed_column, n)]).astype(dtype)
+
+        self.structure = with_composed(structure, COMPOSED, dtype=np.int8)
+        self.variable = with_composed(variable)
+        self.qualifier = with_composed(qualifier)
+        self.modifier = with_composed(modifier)
+        self.interactor = with_composed(interactor)
+        self.value = with_composed(value)
+        self.second_qualifier = with_composed(second_qualifier)
+        self.left = with_composed(np.full(n, -1), pairs[:, 0], dtype=np.int32)
+        self.right = with_composed(np.full(n, -1), pairs[:, 1], dtype=np.int32)
+        self._columns = {
+            'variable': (self.variable, variables), 'variable_': (self.variable, variables),
+            'qualifier': (self.qualifier, qualifiers),
+            'qualifier_': (self.second_qualifier, qualifiers),
+            'modifier': (self.modifier, modifiers), 'interactor': (self.interactor, interactors)}
+
+    def __len__(self):
+        return len(self.structure)
+
+    def tokens(self, row: int) -> dict:
+        """Tokens of the action in `row`, as expected by `parser.Action`."""
+        if self.structure[row] == COMPOSED:
+            tokens = self.tokens(self.left[row])
+            tokens['and'] = 'and'
+            # halves are always base actions, so the keys of the second one get suffix 1
+            tokens.update((f'{k}1', v) for k, v in self.tokens(self.right[row]).items())
+            return tokens
+        tokens = {}
+        for k in ACTION_STRUCTURES[self.structure[row]]:
+            if k == 'value':
+                tokens[k] = int(self.value[row])
+            else:
+                column, vocabulary = self._columns[k]
+                tokens[k] = vocabulary[column[row]]
+        return tokens
+
+    def texts(self) -> list:
+        """Text of every action, as rendered by `parser.Action`."""
+        n = np.count_nonzero(self.structure != COMPOSED)
+        texts = [parser.Action(self.tokens(row)).text for row in range(n)]
+        texts += [f"{texts[i]} and {texts[j]}" for i, j in zip(self.left[n:], self.right[n:])]
+        return texts
+
+    def is_composed(self) -> np.ndarray:
+        return self.structure == COMPOSED
+
+    def something_changing(self) -> np.ndarray:
+        # base actions have a single modifier or interactor, composed ones have two
+        still = [t == 'remains the same' for t in self.modifiers] + [False]
+        still_interaction = [t == 'remains the same' for t in self.interactors] + [False]
+        return self.is_composed() | ~(np.array(still)[self.modifier]
+                                      | np.array(still_interaction)[self.interactor])
+
+    def _variables_and_qualifiers(self) -> tuple:
+        """Variable and qualifier ids of each action, in token order and padded with -1."""
+        base = ~self.is_composed()
+        variables = np.stack([self.variable, np.where(self.structure == 3, self.variable, -1)],
+                             axis=1)[base]
+        qualifiers = np.stack([self.qualifier, self.second_qualifier], axis=1)[base]
+        left, right = self.left[~base], self.right[~base]
+        padding = np.full((len(variables), 2), -1, dtype=variables.dtype)
+        variables = np.concatenate([np.hstack([variables, padding]),
+                                    _compact(np.hstack([variables[left], variables[right]]))])
+        qualifiers = np.concatenate([np.hstack([qualifiers, padding]),
+                                     _compact(np.hstack([qualifiers[left], qualifiers[right]]))])
+        return variables, qualifiers
+
+    def variables_have_conditions(self) -> np.ndarray:
+        variables, qualifiers = self._variables_and_qualifiers()
+        return (qualifiers >= 0).sum(axis=1) >= (variables >= 0).sum(axis=1)
+
+    def var_quals(self) -> np.ndarray:
+        """Ids of the 'variable qualifier' pairs of each action (see
+        `parser.Action.var_quals`), padded with -1."""
+        variables, qualifiers = self._variables_and_qualifiers()
+        ids = variables.astype(np.int32) * len(self.qualifiers) + qualifiers
+        return np.where((variables >= 0) & (qualifiers >= 0), ids, -1)
+
+
 def generate_actions(variables: list, modifiers: list,
                      interactors: list, qualifiers: list) -> list:
     """Generates a list of possible action structured with keys given input combination.
@@ -31,42 +166,53 @@ def generate_actions(variables: list, modifiers: list,
                 5. Action = Action and Action
                     (recursion is allowed)
     """
-    actions = []
-    for vi in variables:
-        for qi in qualifiers:
-            for mi in modifiers:
-                # actions type 1
-                actions.append({'variable': vi, 'qualifier': qi, 'modifier': mi})
-                # actions type 2
-                actions.append({'modifier': mi, 'variable': vi, 'qualifier': qi})
-            for ii in interactors:
-                # actions type 3
-                actions.append({'variable': vi, 'qualifier': qi, 'interactor': ii,
-                                'value':np.random.randint(100)})
-                while True:
-                    qj = np.random.choice(qualifiers)
-                    if qj != qi:
-                        break
-                # actions type 4
-                actions.append({'variable': vi, 'qualifier': qi, 'interactor': ii,
-                                'variable_': vi, 'qualifier_': qj})
-                # actions type 4
-                actions.append({'variable': vi, 'qualifier': qi, 'interactor': ii,
-                                'qualifier_': qj})
-    composed_actions = []
-    for i in range(len(actions)):
-        # sample two actions of different variables (including those generated in this loop)
-        while True:
-            ai, aj = np.random.choice(actions, 2, replace=False)
-            if ai['variable'] != aj['variable']:
-                break
-        # add numerical label to subsequent keys to avoid overriding ai's keys
-        c = np.sum([1 if 'and' in k else 0 for k in {**ai, **aj}]) + 1
-        aj = {f'{k}{c}':aj[k] for k in aj}
-        # actions type 5
-        composed_actions.append({**ai, 'and':'and', **aj})
-    actions += composed_actions
-    return actions
+    table = ActionTable(variables, modifiers, interactors, qualifiers)
+    return [table.tokens(row) for row in range(len(table))]
+
+
+def generate_valid_hypotheses(table: ActionTable):
+    """Yields the text of every appropriate hypothesis (label 0) `if x then y`
+    over all pairs of actions in `table`. Equivalent to keeping the pairs for
+    which `parser.Hypothesis(x, y).label == 0`, but the action-level predicates
+    are evaluated on the columns and Hypothesis objects are never built.
+    """
+    valid_y = table.something_changing() & table.variables_have_conditions()
+    valid_x = valid_y & ~table.is_composed()
+    xs, ys = np.flatnonzero(valid_x), np.flatnonzero(valid_y)
+    var_quals = table.var_quals()
+    x_var_quals, y_var_quals = var_quals[xs], var_quals[ys]
+    # has_variable_on for every (x, y) pair, comparing each pair slot of x with each of y
+    shared = np.zeros((len(xs), len(ys)), dtype=bool)
+    for a in range(x_var_quals.shape[1]):
+        x_slot = x_var_quals[:, a, None]
+        for b in range(y_var_quals.shape[1]):
+            shared |= (x_slot == y_var_quals[None, :, b]) & (x_slot >= 0)
+    texts = table.texts()
+    _, text_ids = np.unique(np.array(texts, dtype=object), return_inverse=True)
+    appropriate = ~shared & (text_ids[xs, None] != text_ids[None, ys])
+    # each side is formatted once, pairs are then a single concatenation
+    x_prefixes = [f"if {texts[i]} then " for i in xs]
+    y_texts = [texts[j] for j in ys]
+    # row by row, so only one row of pairs is materialized at a time
+    for i, row in enumerate(appropriate):
+        prefix = x_prefixes[i]
+        for j in np.flatnonzero(row).tolist():
+            yield prefix + y_texts[j]
+
+
+def sample_hypotheses(hypotheses, n_hypotheses: int) -> list:
+    """Samples `n_hypotheses` without replacement from an iterable of hypotheses,
+    keeping only a reservoir of that size in memory (Algorithm R)."""
+    reservoir = []
+    for n, h in enumerate(hypotheses):
+        if n < n_hypotheses:
+            reservoir.append(h)
+        else:
+            r = random.randrange(n + 1)
+            if r < n_hypotheses:
+                reservoir[r] = h
+    # shuffles the reservoir, and raises if fewer hypotheses than requested exist
+    return random.sample(reservoir, n_hypotheses)
 
 
 def main(domain_file='examples/temperature.json',
@@ -76,22 +222,14 @@ def main(domain_file='examples/temperature.json',
     with open(domain_file, 'r') as f:
         domain = json.load(f)
 
-    actions = [parser.Action(a) for a in generate_actions(**domain)]
-
-    hypotheses = []
-    for acx in actions:
-        for acy in actions:
-            h = parser.Hypothesis(acx, acy)
-            if h.label==0:
-                hypotheses.append(h.forms['direct']['text'])
+    hypotheses = generate_valid_hypotheses(ActionTable(**domain))
 
     if n_hypotheses > 0:
-        hypotheses = np.random.choice(hypotheses,
-                                      n_hypotheses, replace=False)
-
+        hypotheses = sample_hypotheses(hypotheses, n_hypotheses)
 
     with open(output_file, 'w+') as f:
-        f.write('\n'.join(hypotheses))
+        for h in hypotheses:
+            f.write(h + '\n')
 
 
 if __name__=="__main__":
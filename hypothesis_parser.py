@@ -12,25 +12,43 @@ Contributors:
 
 import re
 import json
+import functools
 import numpy as np
 import pandas as pd
 import autocorrect
 import fire
 
 
+_PONCT_RE = re.compile(r'[^\w\s]')
+_NONALPHA_RE = re.compile(r'[^a-zA-Z ]')
+
+
+@functools.lru_cache(maxsize=8)
+def _speller(language: str) -> autocorrect.Speller:
+    """Loads the word-frequency dictionary of `language` only once."""
+    return autocorrect.Speller(language)
+
+
 def preprocess(text: str, language: str = 'en',
                rm_ponct: bool = True, clean_words: bool = True) -> str:
     """Applies word-level autocorrection and removes ponctuation."""
     if language:
-        spell = autocorrect.Speller(language)
+        spell = _speller(language)
         text = spell(text)
-    if rm_ponct:
-        text = re.sub(r'[^\w\s]','', text)
+    # clean_words removes a superset of the ponctuation, so one pass is enough
     if clean_words:
-        text = re.sub(r'[^a-zA-Z ]', '', text)
+        text = _NONALPHA_RE.sub('', text)
+    elif rm_ponct:
+        text = _PONCT_RE.sub('', text)
     return text
 
 
+@functools.lru_cache(maxsize=None)
+def _key_syntax(key: str) -> str:
+    """Syntactic role of a token key, e.g. `qualifier_1` -> `qualifier`."""
+    return preprocess(key, language=False)
+
+
 # Actions
 
 class Action:
@@ -38,37 +56,64 @@ class Action:
 
     def __init__(self, tokens: dict):
         self.tokens = tokens
-        self.text = self.__repr__()
-        self.syntax = ' '.join([preprocess(t, language=False) for t in self.tokens])
+        # single pass for the text, the syntax and the tokens bucketed by their
+        # syntactic role (`qualifier_1` -> `qualifier`)
+        words, roles, self._by = [], [], {}
+        for key, token in self.tokens.items():
+            role = _key_syntax(key)
+            words.append(str(token))
+            roles.append(role)
+            self._by.setdefault(role, []).append(token)
+        self.text = ' '.join(words)
+        self.syntax = ' '.join(roles)
+        self.var_quals = frozenset(f"{i} {j}" for i, j in zip(self.get_by('variable'),
+                                                              self.get_by('qualifier')))
+        # the predicates below only depend on the tokens, so they are settled here
+        changes = self.get_by('interactor') + self.get_by('modifier')
+        self._is_composed = 'and' in self.tokens
+        self._something_changing = changes != ['remains the same'] and len(changes) > 0
+        self._has_conditions = len(self.get_by('qualifier')) >= len(self.get_by('variable'))
 
     def __repr__(self):
-        return ' '.join([str(self.tokens[t]) for t in self.tokens])
+        return self.text
 
     def get_by(self, key: str) -> list:
-        return [self.tokens[t] for t in self.tokens if key in t]
+        return self._by.get(key, [])
 
     def compare_the_same_variable(self) -> bool:
         return self.tokens.get('variable') == self.tokens.get('variable_') \
                  and self.tokens.get('qualifier') != self.tokens.get('qualifier_')
 
     def is_composed(self) -> bool:
-        return 'and' in self.tokens
+        return self._is_composed
 
     def something_changing(self) -> bool:
-        return (self.get_by('interactor') + self.get_by('modifier') != ['remains the same']) \
-            and len(self.get_by('interactor')+self.get_by('modifier')) > 0
+        return self._something_changing
 
     def variables_have_conditions(self) -> bool:
-        return len(self.get_by('qualifier')) >= len(self.get_by('variable'))
+        return self._has_conditions
 
     def has_variable_on(self, action_y) -> bool:
-        x = [f"{i} {j}" for i, j  in zip(self.get_by('variable'),self.get_by('qualifier'))]
-        y = [f"{i} {j}" for i, j  in zip(action_y.get_by('variable'),action_y.get_by('qualifier'))]
-        for i in x:
-            for j in y:
-                if i == j:
-                    return True
-        return False
+        return not self.var_quals.isdisjoint(action_y.var_quals)
+
+
+@functools.lru_cache(maxsize=32)
+def _token_pattern(variables: tuple, modifiers: tuple,
+                   interactors: tuple, qualifiers: tuple) -> tuple:
+    """Compiles the domain tokens into a single alternation and maps each token
+    to its category. Tokens are escaped and sorted longest first across all
+    categories, so a token never shadows a longer one starting at the same
+    position (e.g. `in point` and `in point A`)."""
+    categories = {}
+    for category, terms in [('variable', variables), ('modifier', modifiers),
+                            ('interactor', interactors), ('qualifier', qualifiers)]:
+        for term in terms:
+            categories.setdefault(term, category)
+    pattern = r'(?P<and>\band\b)'
+    if categories:
+        terms = '|'.join(map(re.escape, sorted(categories, key=len, reverse=True)))
+        pattern = f'(?P<token>{terms})|{pattern}'
+    return re.compile(pattern), categories
 
 
 def a_tokenize(action: str, variables: list, modifiers: list,
@@ -76,15 +121,16 @@ def a_tokenize(action: str, variables: list, modifiers: list,
     tokens = {}
     if len(action) == 0:
         return tokens
-    t = []
-    [[t.append((_.start(), v, 'variable')) for _ in re.finditer(v, action)] for v in variables]
-    [[t.append((_.start(), m, 'modifier')) for _ in re.finditer(m, action)] for m in modifiers]
-    [[t.append((_.start(), i, 'interactor')) for _ in re.finditer(i, action)] for i in interactors]
-    [[t.append((_.start(), q, 'qualifier')) for _ in re.finditer(q, action)] for q in qualifiers]
-    [t.append((_.start(), 'and', 'and')) for _ in re.finditer('and', action)]
-    t.sort(key=lambda tup: tup[0])
+    if 'and' not in action and not any(term in action for terms in
+                                       (variables, modifiers, interactors, qualifiers)
+                                       for term in terms):
+        return tokens
+    pattern, categories = _token_pattern(tuple(variables), tuple(modifiers),
+                                         tuple(interactors), tuple(qualifiers))
+    t = [(m.start(), m.group(), 'and' if m.lastgroup == 'and' else categories[m.group()])
+         for m in pattern.finditer(action)]
     flag = True
-    c, c_ = list(range(1,1+len(list(re.finditer(' and ', action))))), ''
+    c, c_ = list(range(1, 1 + action.count(' and '))), ''
     for n, i in enumerate(t):
         if i[2] not in tokens.keys() and flag:
             tokens[i[2]] = i[1]
@@ -137,48 +183,51 @@ class Hypothesis:
         if debug:
             print(f"\nx: {action_x.text}\n >{action_x.tokens}" \
                   f"\ny: {action_y.text}\n >{action_y.tokens}")
-        if action_x.text == action_y.text or len(action_x.text) == 0 or len(action_y.text)==0:
+        self.action_x, self.action_y = action_x, action_y
+        if action_x.text == action_y.text or not action_x.tokens or not action_y.tokens:
             self.label = 1
-            self.forms = [
+        elif not action_x.something_changing() or not action_y.something_changing():
+            self.label = 2
+        elif not action_x.variables_have_conditions() or not action_y.variables_have_conditions():
+            self.label = 3
+        elif action_x.is_composed():
+            self.label = 4
+        elif action_x.has_variable_on(action_y):
+            self.label = 5
+        else:
+            self.label = 0
+
+    @functools.cached_property
+    def forms(self):
+        """Built on first access only, as most callers just need the label."""
+        action_x, action_y = self.action_x, self.action_y
+        if self.label == 1:
+            return [
                 {'text': f"if {action_x.text}", 'syntax': f"if {action_x.syntax}"},
                 {'text': f"then {action_x.text}", 'syntax': f"then {action_x.syntax}"},
                 {'text': f"{action_x.text}", 'syntax': f"{action_x.syntax}"}]
-        else:
-            if not action_x.something_changing() or not action_y.something_changing():
-                self.label = 2
-            elif not action_x.variables_have_conditions() or not action_y.variables_have_conditions():
-                self.label = 3
-            elif action_x.is_composed():
-                self.label = 4
-            elif action_x.has_variable_on(action_y):
-                self.label = 5
-            else:
-                self.label = 0
-            self.forms = {
-                'direct': {"text":f"if {action_x.text} then {action_y.text}",
-                     "syntax": f"if {action_x.syntax} then {action_y.syntax}"},
-                'inverse': {"text":f"{action_y.text} if {action_x.text}",
-                     "syntax": f"{action_y.syntax} if {action_x.syntax}"}
-            }
+        return {
+            'direct': {"text":f"if {action_x.text} then {action_y.text}",
+                 "syntax": f"if {action_x.syntax} then {action_y.syntax}"},
+            'inverse': {"text":f"{action_y.text} if {action_x.text}",
+                 "syntax": f"{action_y.syntax} if {action_x.syntax}"}
+        }
+
+
 
 
+# `if x [then y]`, `y if x`, `then y` or a bare `x`, tried in this order
+_HYPOTHESIS_RE = re.compile(r'if (?P<x>.*?)(?: then (?P<y>.*))?'
+                            r'|(?P<y2>.*?) if (?P<x2>.*)'
+                            r'|then (?P<y3>.*)'
+                            r'|(?P<x3>.*)')
 
 
 def h_tokenize(hypothesis: str) -> dict:
-    tokens = {}
     hypothesis = preprocess(hypothesis)
-    if 'if ' == hypothesis[:3]:
-        if ' then ' in hypothesis:
-            tokens['x'], tokens['y'] = hypothesis[3:].split(' then ')
-        else:
-            tokens['x'], tokens['y'] = hypothesis[3:], ''
-    elif ' if ' in hypothesis:
-        tokens['x'], tokens['y'] = hypothesis.split(' if ')[::-1]
-    elif 'then ' == hypothesis[:5]:
-        tokens['x'], tokens['y'] = '', hypothesis[5:]
-    else:
-        tokens['x'], tokens['y'] = hypothesis, ''
-    return tokens
+    m = _HYPOTHESIS_RE.fullmatch(hypothesis)
+    return {'x': m['x'] or m['x2'] or m['x3'] or '',
+            'y': m['y'] or m['y2'] or m['y3'] or ''}
 
 
 
@@ -0,0 +1,33 @@
+import json
+
+import numpy as np
+import pytest
+
+import hypothesis_parser as parser
+from generate_hypothesis import ActionTable, generate_valid_hypotheses
+
+
+with open('examples/temperature.json') as f:
+    TEMPERATURE = json.load(f)
+
+DOMAINS = [
+    TEMPERATURE,
+    # no `remains the same` modifier, two qualifiers only
+    {"variables": ["pressure", "volume"],
+     "modifiers": ["goes up", "goes down"],
+     "interactors": ["is higher than", "is lower than"],
+     "qualifiers": ["of the gas", "of the piston"]},
+]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('domain', DOMAINS)
+def test_valid_hypotheses_match_parser_labels(domain, seed):
+    """ActionTable's column-wise predicates must agree with `parser.Hypothesis`."""
+    np.random.seed(seed)
+    table = ActionTable(**domain)
+    actions = [parser.Action(table.tokens(row)) for row in range(len(table))]
+    expected = [parser.Hypothesis(x, y).forms['direct']['text']
+                for x in actions for y in actions
+                if parser.Hypothesis(x, y).label == 0]
+    assert list(generate_valid_hypotheses(table)) == expected